@@ -5,20 +5,146 @@
 ################################################################################
 
 
+import os
 import math
-import warnings
 import scipy as sp
+import scipy.special
+import scipy.optimize
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 import pandas as pd
 import itertools
 import random
+import functools
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
 
 import poreana.utils as utils
 import poreana.density as density
 
 
+# Squared zeros of the first order Bessel function derivative and the summand
+# coefficients of the radial msd, the first 20 zeros suffice for the fit
+_Z2 = sp.special.jnp_zeros(1, 20)**2
+_Z2_COEF = 8/(_Z2*(_Z2-1))
+
+# Unit transformation of a msd slope from nm^2 s^-1 to 10^-9 m^2 s^-1
+_DIFF_UNIT = 1e-9**2*1e2**2*1e5
+
+
+def _diff_rad_sum(x, r, ne_size=1e5):
+    """Calculate the summands of the radial msd series for all times. If
+    available, numexpr is used for large grids, since it only pays off there
+    due to its thread overhead.
+
+    Parameters
+    ----------
+    x : ndarray
+        Times
+    r : float
+        Ratio of the diffusion coefficient and the squared pore radius
+    ne_size : float, optional
+        Minimal grid size for using numexpr
+
+    Returns
+    -------
+    sm : ndarray
+        Summands with times as rows and Bessel zeros as columns
+    """
+    if ne is not None and x.size*_Z2.size > ne_size:
+        return ne.evaluate("coef*exp(-z2*r*t)", local_dict={"coef": _Z2_COEF, "z2": _Z2, "r": r, "t": x[:, None]})
+    else:
+        return _Z2_COEF*np.exp(-_Z2*r*x[:, None])
+
+
+def _load_bin(data_link):
+    """Load a bin diffusion data object and convert the sampled msd and
+    normalization bins to contiguous float arrays.
+
+    Parameters
+    ----------
+    data_link : string
+        Link to data object generated by the sample routine
+        :func:`poreana.sample.diffusion_bin`
+
+    Returns
+    -------
+    sample : dictionary
+        Loaded data object
+    """
+    sample = utils.load(data_link)
+    for key in ["z", "r", "n", "z_tot", "r_tot", "n_tot"]:
+        sample["data"][key] = np.ascontiguousarray(sample["data"][key], dtype=float)
+
+    return sample
+
+
+def _load_norm(data_link):
+    """Load the normalized axial msd of each bin of a bin diffusion data
+    object. Results are cached as long as the file is unchanged, so
+    consecutive evaluations of the same object, e.g. by :func:`bins` and
+    :func:`mean`, do not reload and renormalize the data.
+
+    Parameters
+    ----------
+    data_link : string
+        Link to data object generated by the sample routine
+        :func:`poreana.sample.diffusion_bin`
+
+    Returns
+    -------
+    norm : tuple
+        Read-only bin widths, normalized axial msd with bins as rows and
+        read-only time axis in s
+    """
+    stat = os.stat(data_link)
+    return _load_norm_cached(os.path.abspath(data_link), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_norm_cached(data_link, mtime, size):
+    """Cached backend of :func:`_load_norm`, the modification time and size
+    of the file are part of the cache key.
+
+    Parameters
+    ----------
+    data_link : string
+        Absolute link to the data object
+    mtime : integer
+        Modification time of the file in ns
+    size : integer
+        File size in bytes
+
+    Returns
+    -------
+    norm : tuple
+        Bin widths, normalized axial msd and time axis
+    """
+    # Load data
+    sample = _load_bin(data_link)
+    inp = sample["inp"]
+    msd_z = sample["data"]["z"]
+    norm = sample["data"]["n"]
+
+    # Normalize
+    msd_norm = np.divide(msd_z, norm, out=np.zeros_like(msd_z), where=norm>0)
+
+    # Define time axis
+    time_ax = np.arange(inp["len_window"])*inp["len_step"]*inp["len_frame"]
+
+    # Protect cached arrays
+    width = np.asarray(sample["data"]["width"], dtype=float)
+    width.flags.writeable = False
+    msd_norm.flags.writeable = False
+    time_ax.flags.writeable = False
+
+    return width, msd_norm, time_ax
+
+
 def cui(data_link, z_dist=0, ax_area=[0.2, 0.8], intent="", is_fit=False, is_plot=True):
     """This function samples and calculates the diffusion coefficient of a
     molecule group in a pore in both axial and radial direction, as described
@@ -88,86 +214,94 @@ def cui(data_link, z_dist=0, ax_area=[0.2, 0.8], intent="", is_fit=False, is_plo
         True to plot the fitted function
     is_plot : bool, optional
         True to create plot in this function
+
+    Returns
+    -------
+    results : dictionary
+        Axial and radial diffusion coefficients in
+        :math:`10^{-9}\\frac{\\text{m}^2}{\\text{s}}` and the radial fit
+        parameters **popt**, depending on the intent
     """
     # Load data object
-    sample = utils.load(data_link)
+    sample = _load_bin(data_link)
 
     # Load data
     pore = sample["pore"]
     inp = sample["inp"]
     bins = inp["bin_num"] if not z_dist else math.floor(z_dist/sample["data"]["width"][1])
-    msd_z = [0 for x in range(inp["len_window"])]
-    msd_r = [0 for x in range(inp["len_window"])]
-    norm_z = [0 for x in range(inp["len_window"])]
-    norm_r = [0 for x in range(inp["len_window"])]
-
-    # Sum up all bins
-    for i in range(bins):
-        for j in range(inp["len_window"]):
-            msd_z[j] += sample["data"]["z_tot"][i][j]
-            norm_z[j] += sample["data"]["n_tot"][i][j]
-
-    for i in range(inp["bin_num"]):
-        for j in range(inp["len_window"]):
-            msd_r[j] += sample["data"]["r_tot"][i][j]
-            norm_r[j] += sample["data"]["n_tot"][i][j]
+    data = sample["data"]
+
+    # Sum up all bins - reuse radial norm if the axial range covers all bins
+    msd_z = data["z_tot"][:bins].sum(axis=0)
+    msd_r = data["r_tot"][:inp["bin_num"]].sum(axis=0)
+    norm_r = data["n_tot"][:inp["bin_num"]].sum(axis=0)
+    norm_z = norm_r if bins == inp["bin_num"] else data["n_tot"][:bins].sum(axis=0)
 
     # Normalize
-    msd_z_n = [msd_z[i]/norm_z[i] if norm_z[i] > 0 else 0 for i in range(inp["len_window"])]
-    msd_r_n = [msd_r[i]/norm_r[i] if norm_r[i] > 0 else 0 for i in range(inp["len_window"])]
+    msd_z_n = np.divide(msd_z, norm_z, out=np.zeros_like(msd_z), where=norm_z>0)
+    msd_r_n = np.divide(msd_r, norm_r, out=np.zeros_like(msd_r), where=norm_r>0)
 
     # Define time axis and range
-    time_ax = [x*inp["len_step"]*inp["len_frame"] for x in range(inp["len_window"])]
+    time_ax = np.arange(inp["len_window"])*inp["len_step"]*inp["len_frame"]
+    time_ps = time_ax*1e12
     t_range = (inp["len_window"]-1)*inp["len_step"]*inp["len_frame"]
 
     # Calculate axial coefficient
     if not intent or intent == "axial":
-        dz = (msd_z_n[int(ax_area[1]*inp["len_window"])]-msd_z_n[int(ax_area[0]*inp["len_window"])])*1e-9**2/((ax_area[1]-ax_area[0])*t_range)/2*1e2**2*1e5  # 10^-9 m^2s^-1
+        dz = (msd_z_n[int(ax_area[1]*inp["len_window"])]-msd_z_n[int(ax_area[0]*inp["len_window"])])/((ax_area[1]-ax_area[0])*t_range)*(_DIFF_UNIT/2)  # 10^-9 m^2s^-1
 
         print("Diffusion axial:  "+"%.3f" % dz+" 10^-9 m^2s^-1")
 
     # Calculate radial coefficient
     if not intent or intent == "radial":
-        def diff_rad(x, a, b, c):
+        def diff_rad_sum(x, a, c):
             # Process input
-            x = x if isinstance(x, list) or isinstance(x, np.ndarray) else [x]
+            x = np.atleast_1d(np.asarray(x, dtype=float))
 
-            # Get bessel function zeros
-            jz = sp.special.jnp_zeros(1, math.ceil(b))
-            # Calculate sum
-            sm = [[8/(z**2*(z**2-1))*math.exp(-(z/c)**2*a*t) for z in jz] for t in x]
+            return x, _diff_rad_sum(x, a/c**2)
+
+        def diff_rad(x, a, c):
+            x, sm = diff_rad_sum(x, a, c)
             # Final equation
-            return [c**2*(1-sum(s)) for s in sm]
+            return c**2*(1-sm.sum(axis=1))
+
+        def diff_rad_jac(x, a, c):
+            x, sm = diff_rad_sum(x, a, c)
+            # Partial derivatives
+            df_da = (sm*_Z2).sum(axis=1)*x
+            df_dc = 2*c*(1-sm.sum(axis=1))-2*a/c*df_da
+            return np.stack([df_da, df_dc], axis=1)
 
         # Fit function
-        popt, pcov = sp.optimize.curve_fit(diff_rad, [x*1e12 for x in time_ax], msd_r_n, p0=[1, 20, pore["diam"]/2-0.2], bounds=(0, np.inf))
+        popt, pcov = sp.optimize.curve_fit(diff_rad, time_ps, msd_r_n, p0=[1, pore["diam"]/2-0.2], bounds=(0, np.inf), jac=diff_rad_jac, check_finite=False)
 
-        print("Diffusion radial: "+"%.3f" % (popt[0]*1e3)+" 10^-9 m^2 s^-1; Number of zeros: "+"%2i" % (math.ceil(popt[1]))+"; Radius: "+"%5.2f" % popt[2])
+        print("Diffusion radial: "+"%.3f" % (popt[0]*1e3)+" 10^-9 m^2 s^-1; Radius: "+"%5.2f" % popt[1])
 
     # Plot
     if is_plot:
-        legend = []
-
-    if not intent or intent == "axial":
-        sns.lineplot(x=[x*1e12 for x in time_ax], y=msd_z_n)
-        if is_plot:
-            legend += ["Axial"]
-        if is_fit:
-            sns.lineplot(x=[x*1e12 for x in time_ax], y=[dz*2*time_ax[x]/1e5/1e-7**2 for x in range(inp["len_window"])])
-            legend += ["Fitted Axial"]
+        if not intent or intent == "axial":
+            plt.plot(time_ps, msd_z_n, label="Axial")
+            if is_fit:
+                plt.plot(time_ps, dz*2*time_ax/_DIFF_UNIT, label="Fitted Axial")
 
-    if not intent or intent == "radial":
-        sns.lineplot(x=[x*1e12 for x in time_ax], y=msd_r_n)
-        if is_plot:
-            legend += ["Radial"]
-        if is_fit:
-            sns.lineplot(x=[x*1e12 for x in time_ax], y=diff_rad([x*1e12 for x in time_ax], *popt))
-            legend += ["Fitted Radial"]
+        if not intent or intent == "radial":
+            plt.plot(time_ps, msd_r_n, label="Radial")
+            if is_fit:
+                plt.plot(time_ps, diff_rad(time_ps, *popt), label="Fitted Radial")
 
-    if is_plot:
         plt.xlabel("Time (ps)")
         plt.ylabel(r"Mean square displacement (nm$^2$)")
-        plt.legend(legend)
+        plt.legend()
+
+    # Collect results
+    results = {}
+    if not intent or intent == "axial":
+        results["axial"] = dz
+    if not intent or intent == "radial":
+        results["radial"] = popt[0]*1e3
+        results["popt"] = popt
+
+    return results
 
 
 def bins(data_link, ax_area=[0.2, 0.8], intent="plot", is_norm=False):
@@ -215,25 +349,15 @@ def bins(data_link, ax_area=[0.2, 0.8], intent="plot", is_norm=False):
         List of the slope of the non-normalized diffusion coefficient
     """
     # Load data object
-    sample = utils.load(data_link)
-
-    # Load data
-    inp = sample["inp"]
-    width = sample["data"]["width"]
-    msd_z = sample["data"]["z"]
-    norm = sample["data"]["n"]
-
-    # Normalize
-    msd_norm = [[msd_z[i][j]/norm[i][j] if norm[i][j] > 0 else 0 for j in range(inp["len_window"])] for i in range(inp["bin_num"]+1)]
+    width, msd_norm, time_ax = _load_norm(data_link)
 
     # Calculate slope
-    f_start = int(ax_area[0]*inp["len_window"])
-    f_end = int(ax_area[1]*inp["len_window"])
-    time_ax = [x*inp["len_step"]*inp["len_frame"] for x in range(inp["len_window"])]
-    slope = [(msd_norm[i][f_end]-msd_norm[i][f_start])/(time_ax[f_end]-time_ax[f_start]) for i in range(inp["bin_num"]+1)]
+    f_start = int(ax_area[0]*len(time_ax))
+    f_end = int(ax_area[1]*len(time_ax))
+    slope = (msd_norm[:, f_end]-msd_norm[:, f_start])/(time_ax[f_end]-time_ax[f_start])
 
     # Calculate diffusion coefficient
-    diff = [msd*1e-9**2/2*1e2**2*1e5 for msd in slope]  # 10^-9 m^2s^-1
+    diff = slope*(_DIFF_UNIT/2)  # 10^-9 m^2s^-1
 
     # Normalize x-axis
     if is_norm:
@@ -247,7 +371,7 @@ def bins(data_link, ax_area=[0.2, 0.8], intent="plot", is_norm=False):
     # Plot
     if intent == "plot" or intent == "line":
         x_axis = bins_norm if is_norm else width
-        sns.lineplot(x=x_axis[:-1], y=diff)
+        plt.plot(x_axis[:-1], diff)
 
     if intent == "plot":
         if is_norm:
@@ -256,7 +380,7 @@ def bins(data_link, ax_area=[0.2, 0.8], intent="plot", is_norm=False):
             plt.xlabel("Distance from pore center (nm)")
         plt.ylabel(r"Diffusion coefficient ($10^{-9}$ m${^2}$ s$^{-1}$)")
 
-    return {"width": width, "diff": diff}
+    return {"width": width.copy(), "diff": diff}
 
 
 def mean(data_link_diff, data_link_dens, ax_area=[0.2, 0.8], is_norm=False, is_check=False):
@@ -282,7 +406,9 @@ def mean(data_link_diff, data_link_dens, ax_area=[0.2, 0.8], is_norm=False, is_c
 
         A(r_i)=\\pi(r_i^2-r_{i-1}^2)
 
-    of radial bin :math:`i`.
+    of radial bin :math:`i`. Since the density and diffusion bins do not
+    necessarily coincide, the density is linearly interpolated on the
+    diffusion bins.
 
     Parameters
     ----------
@@ -297,7 +423,7 @@ def mean(data_link_diff, data_link_dens, ax_area=[0.2, 0.8], is_norm=False, is_c
     is_norm : bool, optional
         True to normalize x-axis
     is_check : bool, optional
-        True to plot density function fit
+        True to plot the interpolated density function
 
     Returns
     -------
@@ -308,29 +434,26 @@ def mean(data_link_diff, data_link_dens, ax_area=[0.2, 0.8], is_norm=False, is_c
     dens = density.calculate(data_link_dens, is_print=False)
     diff_bin = bins(data_link_diff, ax_area=ax_area, intent="", is_norm=is_norm)
 
-    # Get number of bins
-    bin_num = len(diff_bin["width"][:-1])
-
     # Set diffusion functions
-    width = diff_bin["width"][:-1]
-    diff = diff_bin["diff"]
+    width = np.asarray(diff_bin["width"][:-1], dtype=float)
+    diff = np.asarray(diff_bin["diff"], dtype=float)
 
-    # Fit density function
-    with warnings.catch_warnings():
-        warnings.filterwarnings('ignore', r'Polyfit may be poorly conditioned')
-        param = np.polyfit(dens["sample"]["data"]["in_width"][:-1], dens["num_dens"]["in"], 100)
-        dens_f = np.poly1d(param)(width)
+    # Interpolate density function on diffusion bins
+    dens_f = np.interp(width, dens["sample"]["data"]["in_width"][:-1], dens["num_dens"]["in"])
 
     # Plot fit
     if is_check:
-        sns.lineplot(x=dens["sample"]["data"]["in_width"][:-1], y=dens["num_dens"]["in"])
-        sns.lineplot(x=width, y=dens_f)
+        plt.plot(dens["sample"]["data"]["in_width"][:-1], dens["num_dens"]["in"])
+        plt.plot(width, dens_f)
+
+    # Density weighted partial areas
+    dens_area = dens_f[:-1]*(width[1:]**2-width[:-1]**2)
 
     # Integrate density
-    dens_int = sum([dens_f[i]*(width[i+1]**2-width[i]**2) for i in range(bin_num-1)])
+    dens_int = dens_area.sum()
 
     # Calculate weighted diffusion
-    diff_int = sum([dens_f[i]*diff[i]*(width[i+1]**2-width[i]**2) for i in range(bin_num-1)])
+    diff_int = (dens_area*diff[:-1]).sum()
 
     # Normalize
     diff_weight = diff_int/dens_int
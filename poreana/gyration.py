@@ -5,7 +5,7 @@
 ################################################################################
 
 
-import seaborn as sns
+import numpy as np
 import matplotlib.pyplot as plt
 
 import poreana.utils as utils
@@ -43,35 +43,38 @@ def plot(data_link_gyr, data_link_dens, intent="", is_mean=False):
     dens = utils.load(data_link_dens)
     is_pore = "pore" in gyr
     width = {}
-    width["in"] = gyr["data"]["in_width"][:-1] if is_pore else []
-    width["ex"] = gyr["data"]["ex_width"]
+    width["in"] = np.asarray(gyr["data"]["in_width"][:-1] if is_pore else [], dtype=float)
+    width["ex"] = np.asarray(gyr["data"]["ex_width"], dtype=float)
 
     areas = ["in", "ex"] if is_pore else ["ex"]
 
     # Divide gyration radius by density in bins
-    gyration = {area: [gyr["data"][area][i]/dens["data"][area][i] if dens["data"][area][i] else 0 for i in range(len(gyr["data"][area]))] for area in areas}
+    gyration = {}
+    for area in areas:
+        gyr_area = np.asarray(gyr["data"][area], dtype=float)
+        dens_area = np.asarray(dens["data"][area], dtype=float)
+        gyration[area] = np.divide(gyr_area, dens_area, out=np.zeros_like(gyr_area), where=dens_area!=0)
 
     # Calculate mean gyration radius
-    mean = {area: sum(gyration[area])/len(gyration[area]) for area in areas}
+    mean = {area: float(gyration[area].mean()) for area in areas}
+
+    # Plot gyration radius and optionally its mean over the given bins
+    def draw(area, is_mean):
+        plt.plot(width[area], gyration[area])
+        if is_mean:
+            plt.plot(width[area], np.full(width[area].shape, mean[area]))
+        plt.xlim([0, width[area][-1]])
 
     # Full plot
     if not intent:
         plt.subplot(211)
-        sns.lineplot(x=width["in"], y=gyration["in"])
-        if is_mean:
-            sns.lineplot(x=width["in"], y=[mean["in"] for x in width["in"]])
-
-        plt.xlim([0, width["in"][-1]])
+        draw("in", is_mean)
         plt.xlabel("Distance from pore center (nm)")
         plt.ylabel(r"Radius (nm)")
         plt.legend(["Gyration radius", "Mean"])
 
         plt.subplot(212)
-        sns.lineplot(x=width["ex"], y=gyration["ex"])
-        if is_mean:
-            sns.lineplot(x=width["ex"], y=[mean["ex"] for x in width["ex"]])
-
-        plt.xlim([0, width["ex"][-1]])
+        draw("ex", is_mean)
         plt.xlabel("Distance from reservoir end (nm)")
         plt.ylabel(r"Radius (nm)")
         plt.legend(["Gyration radius", "Mean"])
@@ -82,7 +85,6 @@ def plot(data_link_gyr, data_link_dens, intent="", is_mean=False):
             print("Invalid intent. Check documentation for available options.")
             return
 
-        sns.lineplot(x=width[intent], y=gyration[intent])
-        plt.xlim([0, width[intent][-1]])
+        draw(intent, False)
 
     return mean
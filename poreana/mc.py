@@ -460,12 +460,11 @@ class MC:
         # Attion the first coefficent of the diffusion profile is fixed 0 all the time
         idx = np.random.randint(0,model._n_diff)
 
-        # Calculate one new coefficient
-        diff_coeff_temp = copy.deepcopy(model._diff_coeff)
-        diff_coeff_temp[idx] += self._delta_diff * (np.random.random() - 0.5)
+        # Calculate the change of one coefficient
+        delta = self._delta_diff * (np.random.random() - 0.5)
 
-        # Use the new coeff to calculate a new diffusion profile
-        diff_bin_temp = model.calc_profile(diff_coeff_temp, model._diff_basis)
+        # Use the changed coeff to update the diffusion profile
+        diff_bin_temp = model.update_profile(model._diff_bin, model._diff_basis, idx, delta)
 
         #Calculate a new likelihood to check acceptance of the step
         log_like_try = self.log_likelihood_z(model, diff_bin_temp)
@@ -483,10 +482,10 @@ class MC:
             if r < np.exp(dlog / self._temp): # warum geht hier eig die Temperatur mit ein?
 
                 # Save new diffusion profile (after MC step)
-                model._diff_bin[:] = diff_bin_temp[:]
+                model._diff_bin = diff_bin_temp
 
                 # Save new coefficent vector
-                model._diff_coeff[:] = diff_coeff_temp[:]
+                model._diff_coeff[idx] += delta
 
                 #Save new likelihood
                 self._log_like = log_like_try
@@ -521,12 +520,11 @@ class MC:
         # Attion the first coefficent of the df profile is fixed 0 all the time
         idx = np.random.randint(1,model._n_df)
 
-        # Calculate one new coefficient
-        df_coeff_temp = copy.deepcopy(model._df_coeff)
-        df_coeff_temp[idx] += self._delta_df * (np.random.random() - 0.5)
+        # Calculate the change of one coefficient
+        delta = self._delta_df * (np.random.random() - 0.5)
 
-        # Use the new coeff to calculate a new diffusion profile
-        df_bin_temp = model.calc_profile(df_coeff_temp, model._df_basis)
+        # Use the changed coeff to update the diffusion profile
+        df_bin_temp = model.update_profile(model._df_bin, model._df_basis, idx, delta)
 
         #Calculate a new likelihood to check acceptance of the step
         log_like_try = self.log_likelihood_z(model, df_bin_temp)
@@ -544,10 +542,10 @@ class MC:
             if r < np.exp(dlog / self._temp): # warum geht hier eig die Temperatur mit ein?
 
                 # Save new diffusion profile (after MC step)
-                model._df_bin[:] = df_bin_temp[:]
+                model._df_bin = df_bin_temp
 
                 # Save new coefficent vector
-                model._df_coeff[:] = df_coeff_temp[:]
+                model._df_coeff[idx] += delta
 
                 #Save new likelihood
                 self._log_like = log_like_try
@@ -580,12 +578,11 @@ class MC:
         # Attion the first coefficent of the diffusion profile is fixed 0 all the time
         idx = np.random.randint(0,model._n_diff_radial)
 
-        # Calculate one new coefficient
-        diff_radial_coeff_temp = copy.deepcopy(model._diff_radial_coeff)
-        diff_radial_coeff_temp[idx] += self._delta_diff_radial * (np.random.random() - 0.5)
+        # Calculate the change of one coefficient
+        delta = self._delta_diff_radial * (np.random.random() - 0.5)
 
-        # Use the new coeff to calculate a new diffusion profile
-        diff_radial_bin_temp = model.calc_profile(diff_radial_coeff_temp, model._diff_radial_basis)
+        # Use the changed coeff to update the diffusion profile
+        diff_radial_bin_temp = model.update_profile(model._diff_radial_bin, model._diff_radial_basis, idx, delta)
 
         #Calculate a new likelihood to check acceptance of the step
         log_like_try = self.log_likelihood_radial(model,diff_radial_bin_temp)
@@ -603,10 +600,10 @@ class MC:
             if r < np.exp(dlog / self._temp): # warum geht hier eig die Temperatur mit ein?
 
                 # Save new diffusion profile (after MC step)
-                model._diff_radial_bin[:] = diff_radial_bin_temp[:]
+                model._diff_radial_bin = diff_radial_bin_temp
 
                 # Save new coefficent vector
-                model._diff_radial_coeff[:] = diff_radial_coeff_temp[:]
+                model._diff_radial_coeff[idx] += delta
 
                 #Save new likelihood
                 self._log_like_radial = log_like_try
@@ -729,8 +726,8 @@ class MC:
 
 
         # diagonal elements
-        for i in range(1,n-1):
-            rate[i,i] = - rate[i-1,i] - rate[i+1,i]
+        idx = np.arange(1,n-1)
+        rate[idx,idx] = - rate[idx-1,idx] - rate[idx+1,idx]
 
         return rate
 
@@ -801,8 +798,8 @@ class MC:
         rate[-1,-1] = - rate[-2,-1]
 
         # diagonal elements
-        for i in range(1,n-1):
-            rate[i,i] = - rate[i-1,i] - rate[i+1,i]
+        idx = np.arange(1,n-1)
+        rate[idx,idx] = - rate[idx-1,idx] - rate[idx+1,idx]
 
         return rate
 
@@ -855,9 +852,9 @@ class MC:
         # Calculate the propagtor
         propagator = scipy.linalg.expm(self._len_step * model._dt * rate)
 
-        # Calculate likelihood
-        mat = model._trans_mat[self._len_step] * np.log(propagator.clip(tiny))
-        log_like = np.sum(mat)
+        # Calculate likelihood over the observed transitions
+        idx, counts = model._trans_mat_nz[self._len_step]
+        log_like = np.dot(counts, np.log(propagator.ravel()[idx].clip(tiny)))
 
         return log_like
 
@@ -3,6 +3,48 @@ import pandas as pd
 
 import poreana.utils as utils
 
+def _cos_basis(phase, num):
+    """Calculate a Fourier cosine basis
+
+    .. math::
+
+        \\mathrm{basis}_{ik} = \\frac{\\cos(k\\theta_i)}{k+1}
+
+    for the phases :math:`\\theta_i` and :math:`k=0,...,n-1`. Instead of
+    evaluating the cosine for every coefficient, the recurrence
+
+    .. math::
+
+        \\cos((k+1)\\theta) = 2\\cos(\\theta)\\cos(k\\theta)-\\cos((k-1)\\theta)
+
+    is used, so that the cosine is only evaluated once per phase.
+
+    Parameters
+    ----------
+    phase : ndarray
+        Phases of the bins
+    num : integer
+        Number of coefficients
+
+    Returns
+    -------
+    basis : ndarray
+        Basis matrix with bins as rows and coefficients as columns
+    """
+    basis = np.empty((phase.size, num), order="F")
+    if num > 0:
+        basis[:, 0] = 1.
+    if num > 1:
+        basis[:, 1] = np.cos(phase)
+    for k in range(2, num):
+        basis[:, k] = 2*basis[:, 1]*basis[:, k-1]-basis[:, k-2]
+
+    # Scale coefficients
+    basis /= np.arange(1, num+1)
+
+    return basis
+
+
 class Model:
     """This class sets the general parameters which are used to initialize
     a model.
@@ -15,6 +57,10 @@ class Model:
         initial guess of diffusion coefficent
     """
 
+    # Basis matrices shared between model instances, keyed by model type and
+    # basis parameters
+    _basis_cache = {}
+
     def __init__(self, data_link, d0=1e-8):
 
         # Load data object
@@ -29,7 +75,16 @@ class Model:
         self._dt = inp["len_frame"] * 10**12                                 # frame length [ps]
         self._bins = inp["bins"]                                             # bins [nm]
         self._bin_width = self._bins[1] - self._bins[0]                      # bin width [nm]
+        self._bin_idx = np.arange(self._bin_num)                             # bin indices
         self._trans_mat = sample["data"]                                     # transition matrix
+
+        # Flat indices and counts of the observed transitions, since most
+        # entries of the transition matrices are zero
+        self._trans_mat_nz = {}
+        for step, mat in self._trans_mat.items():
+            mat = np.asarray(mat, dtype=float).ravel()
+            idx = np.flatnonzero(mat)
+            self._trans_mat_nz[step] = (idx, mat[idx])
         self._pbc = inp["pbc"]                                               # pbc or nopbc
         self._d0 = d0 * (10**18)/(10**12)                                    # guess init profile [A^2/ps]
 
@@ -37,6 +92,9 @@ class Model:
         self._df_unit = 1.                                                   # in kBT
         self._diff_unit = np.log(self._bin_width**2 / 1.)                    # in m^2/s
 
+        # Initial value of the ln(diffusion) profile in units of the bin width
+        self._diff_init = np.log(self._d0) - self._diff_unit
+
         return
 
     def init_profiles(self):
@@ -45,21 +103,83 @@ class Model:
         free energy profile over the bins.
         """
 
-        # Initialize the diffusion and free energy profile
-        self._df_bin = np.float64(np.zeros(self._bin_num))                   # in kBT
-        self._diff_bin = np.float64(np.zeros(self._bin_num))                 # in dz**2/dt
+        # Initialize the free energy and diffusion profile
+        self._df_bin = np.zeros(self._bin_num)                                  # in kBT
+        self._diff_bin = np.full(self._bin_num, self._diff_init)                # in dz**2/dt
+
+
+    def cached_basis(self, key, create):
+        """
+        This function returns the basis matrices for the given key. Since the
+        bases only depend on the number of bins and coefficients, they are
+        created once with the passed function and shared between all models
+        with the same parameters. The cached matrices are stored column-major
+        and read-only.
+
+        Parameters
+        ----------
+        key : tuple
+            Model type and basis parameters
+        create : function
+            Function creating a tuple of basis matrices
+
+        Returns
+        -------
+        basis : tuple
+            Tuple of read-only basis matrices
+        """
+        if key not in Model._basis_cache:
+            # Column-major storage for contiguous columns in update_profile
+            basis = tuple(np.asfortranarray(mat) for mat in create())
+            for mat in basis:
+                mat.flags.writeable = False
+            Model._basis_cache[key] = basis
+
+        return Model._basis_cache[key]
+
+    def update_profile(self, profile, basis, idx, delta):
+        """
+        This function updates a profile after the adjustment of a single
+        coefficient in a Monte Carlo step. Since the profile is linear in the
+        coefficients, only the basis column of the changed coefficient has to
+        be added
+
+        .. math::
+
+            \\mathrm{profile}_\\text{new} = \\mathrm{profile} + \\Delta a_{k} \\cdot \\mathrm{basis}_{k}.
 
+        This avoids the full evaluation with :func:`calc_profile` in every MC
+        step.
 
-        #Initalize the diffusion profile
-        self._diff_bin += (np.log(self._d0) - self._diff_unit)
+        Parameters
+        ----------
+        profile : list
+            Current profile over the bins
+        basis : list
+            Basis part of the model
+        idx : integer
+            Index of the adjusted coefficient
+        delta : float
+            Change of the coefficient
+
+        Returns
+        -------
+        profile : list
+            New profile over the bins
+        """
+        # Scale the basis column into a new array and add the profile in place
+        new_profile = delta * basis[:, idx]
+        new_profile += profile
 
+        return new_profile
 
     def calc_profile(self, coeff, basis):
         """
         This function calculates the diffusion and free energy profile over the
         bins. It is used to initialize the system at the beginning of the
-        calculation/MC run. Additional it is needed to update the profiles
-        in the Monte Carlo part after the adjustment of a profile coefficient.
+        calculation/MC run. In the Monte Carlo part the profiles are updated
+        after the adjustment of a profile coefficient with
+        :func:`update_profile`.
 
         The profile is determining with the basis and the coefficients for the
         free energy with
@@ -97,12 +217,10 @@ class Model:
             list of the basis part of model
         """
 
-        # Calculate a matrix with the bin_num x ncos
+        # Matrix-vector product of the bin_num x ncos basis and the coefficients
             # Columns contains the n-summand in every bin
             # Line contains the summand of the series
-        a = coeff * basis
-
-        return np.sum(a,axis=1)
+        return np.dot(basis, np.asarray(coeff))
 
 
 
@@ -140,9 +258,11 @@ class CosineModel(Model):
         number of the Fourier coefficients for the free energy profile
     n_diff_radial : integer, optional
         number of the Fourier coefficients for the radial diffusion profile
+    is_print : bool, optional
+        True to print the model inputs
     """
 
-    def __init__(self, data_link, n_diff=6, n_df=10, n_diff_radial=6):
+    def __init__(self, data_link, n_diff=6, n_df=10, n_diff_radial=6, is_print=False):
 
         # Inherit the variables from Model class
         super(CosineModel,self).__init__(data_link)
@@ -162,7 +282,7 @@ class CosineModel(Model):
         self.init_profiles()
 
         # Set basis of Fourier series
-        self.cosine_model()
+        self.cosine_model(is_print)
 
 
     def init_model(self):
@@ -173,18 +293,21 @@ class CosineModel(Model):
         """
 
         # # Initialize the diffusion and free energy coefficient
-        self._df_coeff = np.float64(np.zeros(self._n_df))                       # in dz**2/dt
-        self._diff_coeff = np.float64(np.zeros(self._n_diff))                   # in dz**2/dt
-
+        self._df_coeff = np.zeros(self._n_df)                                   # in dz**2/dt
+        self._diff_coeff = np.zeros(self._n_diff)                               # in dz**2/dt
 
         # # Set start diffusion profile
-        self._diff_coeff = np.zeros((self._n_diff),float)
-        self._diff_coeff[0] += (np.log(self._d0) - self._diff_unit)             # initialize diffusion profile with the guess value [A^2/ps]
+        self._diff_coeff[0] = self._diff_init                                   # initialize diffusion profile with the guess value [A^2/ps]
 
 
-    def cosine_model(self):
+    def cosine_model(self, is_print=False):
         """This function sets a Fourier Cosine Series Model for the MC Diffusion
         Calculation and determines the initialize profiles.
+
+        Parameters
+        ----------
+        is_print : bool, optional
+            True to print the model inputs
         """
 
         # create basis (for the free energy)
@@ -201,20 +324,21 @@ class CosineModel(Model):
         self._df_bin = self.calc_profile(self._df_coeff,self._df_basis)
 
         # Print for console
-        print("\n-----------------------------------------------------------------------------------------------------------------------------------------------------------------")
-        print("----------------------------------------------------------------Initialize CosineModel-------------------------------------------------------------------------")
-        print("-----------------------------------------------------------------------------------------------------------------------------------------------------------------\n")
-        print("Model Inputs")
+        if is_print:
+            print("\n-----------------------------------------------------------------------------------------------------------------------------------------------------------------")
+            print("----------------------------------------------------------------Initialize CosineModel-------------------------------------------------------------------------")
+            print("-----------------------------------------------------------------------------------------------------------------------------------------------------------------\n")
+            print("Model Inputs")
 
-        # Set data list for panda table
-        len_step_string = ', '.join(str(step) for step in self._len_step)
-        data = [str("%.f" % self._bin_num),  len_step_string, str("%.2e" % (self._dt * 10**(-12))), str("%.f" % self._n_diff), str("%.f" % self._n_df), self._model, self._pbc, str("%.2e" % (self._d0 * (10**(-18))/(10**(-12))))]
+            # Set data list for panda table
+            len_step_string = ', '.join(str(step) for step in self._len_step)
+            data = [str("%.f" % self._bin_num),  len_step_string, str("%.2e" % (self._dt * 10**(-12))), str("%.f" % self._n_diff), str("%.f" % self._n_df), self._model, self._pbc, str("%.2e" % (self._d0 * (10**(-18))/(10**(-12))))]
 
-        # Set pandas table
-        df_model = pd.DataFrame(data,index=list(['Bin number','step length','frame length','nD','nF','model','pbc','guess diffusion (m2/s-1)']),columns=list(['Input']))
+            # Set pandas table
+            df_model = pd.DataFrame(data,index=list(['Bin number','step length','frame length','nD','nF','model','pbc','guess diffusion (m2/s-1)']),columns=list(['Input']))
 
-        # Print panda table with model inputs
-        print(df_model)
+            # Print panda table with model inputs
+            print(df_model)
 
 
     def create_basis_center(self):
@@ -232,16 +356,18 @@ class CosineModel(Model):
 
         """
 
-        # Allocate a vector with bin_num entries
-        x = np.arange(self._bin_num)
+        def create():
+            # Phase in the bin centers
+            phase = 2 * np.pi * (self._bin_idx + 0.5) / self._bin_num
+
+            # Calculate basis for Fourier cosine series (bin_num x ncos Matrix)
+            # for the larger number of coefficients and share it
+            basis = _cos_basis(phase, max(self._n_df, self._n_diff_radial))
 
-        # Calculate basis for Fourier cosine series
-        basis_df = [np.cos(2 * k * np.pi *(x + 0.5) / self._bin_num) / (k + 1) for k in range(self._n_df)]                      # basis for the free energy profile
-        basis_diff_radial = [np.cos(2 * k * np.pi *(x + 0.5) / self._bin_num) / (k + 1) for k in range(self._n_diff_radial)]    # basis for the radial energy profile
+            return basis[:, :self._n_df], basis[:, :self._n_diff_radial]      # basis for the free energy and radial diffusion profile
 
-        # Transpose basis (is now a bin_num x ncos Matrix)
-        self._df_basis = np.array(basis_df).transpose()
-        self._diff_radial_basis = np.array(basis_diff_radial).transpose()
+        key = ("cos_center", self._bin_num, self._n_df, self._n_diff_radial)
+        self._df_basis, self._diff_radial_basis = self.cached_basis(key, create)
 
 
     def create_basis_border(self):
@@ -257,14 +383,15 @@ class CosineModel(Model):
         hereby :math:`k` is the number of coefficients, :math:`i` is the bin
         index and :math:`n` is the number of the bins.
         """
-        # Allocate a vector with bin_num entries
-        x = np.arange(self._bin_num)
+        def create():
+            # Phase at the bin borders
+            phase = 2 * np.pi * (self._bin_idx + 1.) / self._bin_num
 
-        # Calculate basis for Fourier cosine series
-        basis = [np.cos(2 * k * np.pi * (x + 1.) / self._bin_num) / (k + 1) for k in range(self._n_diff)]
+            # Calculate basis for Fourier cosine series (bin_num x ncos Matrix)
+            return (_cos_basis(phase, self._n_diff),)
 
-        # Transpose basis (is now a bin_num x ncos Matrix)
-        self._diff_basis = np.array(basis).transpose()
+        key = ("cos_border", self._bin_num, self._n_diff)
+        self._diff_basis, = self.cached_basis(key, create)
 
 class StepModel(Model):
     """This class sets the Step Model to calculate the free energy profile and
@@ -306,6 +433,11 @@ class StepModel(Model):
         self._n_df = n_df                                                       # number of free energy profile coefficien
         self._n_diff_radial = n_diff_radial                                     # number of radial diffusion profile coeff
 
+        # The sampled transition matrices have no radial bins, hence the radial
+        # profile uses the axial bins and units
+        self._bin_num_rad = self._bin_num
+        self._diff_radial_unit = self._diff_unit
+
         # Initial model
         self.init_model()
 
@@ -323,9 +455,9 @@ class StepModel(Model):
         """
 
         # # Initialize the diffusion and free energy coefficient
-        self._df_coeff = np.float64(np.zeros(self._n_df))
-        self._diff_coeff = np.float64(np.zeros(self._n_diff))
-        self._diff_radial_coeff = np.float64(np.zeros(self._n_diff))
+        self._df_coeff = np.zeros(self._n_df)
+        self._diff_coeff = np.zeros(self._n_diff)
+        self._diff_radial_coeff = np.zeros(self._n_diff_radial)
 
         # Calculate dz
         dx_df = self._bin_num /2. /self._n_df
@@ -337,8 +469,8 @@ class StepModel(Model):
         self._diff_radial_x0 = np.arange(0, self._n_diff_radial * dx_diff_radial, dx_diff_radial)
 
         # # Set start diffusion profile
-        self._diff_coeff[0] += (np.log(self._d0) - self._diff_unit)                  # initialize diffusion profile with the guess value [A^2/ps]
-        self._diff_radial_coeff[0] += (np.log(self._d0) - self._diff_radial_unit)    # initialize diffusion profile with the guess value [A^2/ps]
+        self._diff_coeff[0] = self._diff_init                                        # initialize diffusion profile with the guess value [A^2/ps]
+        self._diff_radial_coeff[0] = (np.log(self._d0) - self._diff_radial_unit)    # initialize diffusion profile with the guess value [A^2/ps]
 
     def step_model(self):
         """This function set a Step Model for the MC Diffusion Calculation
@@ -352,13 +484,52 @@ class StepModel(Model):
         self.create_basis_border()
 
         # Update diffusion profile
-        self._diff_bin = self.calc_profile(self._diff_coeff,self._diff_basis)
+        self._diff_bin = self.calc_step_profile(self._diff_coeff, self._diff_x0, 1., self._bin_num)
 
         # Update free energy profile
-        self._df_bin = self.calc_profile(self._df_coeff,self._df_basis)
+        self._df_bin = self.calc_step_profile(self._df_coeff, self._df_x0, 0.5, self._bin_num)
 
         # Update radial diffusion profile
-        self._diff_radial_bin = self.calc_profile(self._diff_radial_coeff,self._diff_radial_basis)
+        self._diff_radial_bin = self.calc_step_profile(self._diff_radial_coeff, self._diff_radial_x0, 0.5, self._bin_num_rad)
+
+    def calc_step_profile(self, coeff, x0, offset, bin_num):
+        """
+        This function calculates a profile of the Step model without the
+        basis matrix. Every basis column is one on the bins
+        :math:`\\mathrm{bin}` with
+        :math:`\\Delta x\\leq\\mathrm{bin}+\\mathrm{offset}\\leq n_{\\mathrm{bin}}-\\Delta x`
+        and zero else. Hence, the profile is the cumulative sum of a
+        difference array, which adds each coefficient at the first bin of its
+        interval and subtracts it after the last bin. This yields the same
+        profile as :func:`Model.calc_profile` with the corresponding basis.
+
+        Parameters
+        ----------
+        coeff : list
+            list of coefficients
+        x0 : list
+            Step positions :math:`\\Delta x` of the coefficients
+        offset : float
+            Position in the bin, 0.5 for the center and 1 for the border
+        bin_num : integer
+            Number of bins
+
+        Returns
+        -------
+        profile : list
+            Profile over the bins
+        """
+        # Bin intervals of the steps
+        lo = np.clip(np.ceil(x0 - offset), 0, bin_num).astype(int)
+        hi = np.floor(bin_num - x0 - offset).astype(int)
+        is_step = lo <= hi
+
+        # Difference array of the coefficients
+        coeff = np.asarray(coeff, dtype=float)[is_step]
+        diff = np.bincount(lo[is_step], weights=coeff, minlength=bin_num+1)
+        diff -= np.bincount(hi[is_step]+1, weights=coeff, minlength=bin_num+1)
+
+        return np.cumsum(diff[:bin_num])
 
     def create_basis_center(self):
         """
@@ -388,15 +559,17 @@ class StepModel(Model):
 
         """
 
-        # Calculated the basis in the center of a bin
-        x = np.arange(self._bin_num)+0.5
-        x_rad = np.arange(self._bin_num_rad)+0.5
-        basis = [np.where((x>=i) & (x<=self._bin_num-i),1.,0.) for i in self._df_x0]
-        basis_rad = [np.where((x_rad>=i) & (x_rad<=self._bin_num_rad-i),1.,0.) for i in self._diff_radial_x0]
+        def create():
+            # Calculated the basis in the center of a bin (bin_num x ncos Matrix)
+            x = (self._bin_idx+0.5)[:, None]
+            x_rad = (np.arange(self._bin_num_rad)+0.5)[:, None]
+            basis = ((x>=self._df_x0) & (x<=self._bin_num-self._df_x0)).astype(float)
+            basis_rad = ((x_rad>=self._diff_radial_x0) & (x_rad<=self._bin_num_rad-self._diff_radial_x0)).astype(float)
+
+            return basis, basis_rad
 
-        # Transpose basis (is now a bin_num x ncos Matrix)
-        self._df_basis = np.array(basis).transpose()
-        self._diff_radial_basis = np.array(basis_rad).transpose()
+        key = ("step_center", self._bin_num, self._bin_num_rad, tuple(self._df_x0), tuple(self._diff_radial_x0))
+        self._df_basis, self._diff_radial_basis = self.cached_basis(key, create)
 
     def create_basis_border(self):
         """
@@ -422,9 +595,10 @@ class StepModel(Model):
         with :math:`i = [1,...,n_{\\mathrm{diff}}-1]`.
         """
 
-        # Calculated the basis in the border of a bin
-        x = np.arange(self._bin_num)+1.
-        basis = [np.where((x>=i) & (x<=self._bin_num-i),1.,0.) for i in self._diff_x0]
+        def create():
+            # Calculated the basis in the border of a bin (bin_num x ncos Matrix)
+            x = (self._bin_idx+1.)[:, None]
+            return (((x>=self._diff_x0) & (x<=self._bin_num-self._diff_x0)).astype(float),)
 
-        # Transpose basis (is now a bin_num x ncos Matrix)
-        self._diff_basis = np.array(basis).transpose()
+        key = ("step_border", self._bin_num, tuple(self._diff_x0))
+        self._diff_basis, = self.cached_basis(key, create)
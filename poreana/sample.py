@@ -7,13 +7,53 @@
 
 import sys
 import math
+import queue
+import threading
 import chemfiles as cf
 import multiprocessing as mp
 import numpy as np
 
 import porems as pms
 import poreana.utils as utils
-import poreana.geometry as geometry
+
+
+# Molecule regions - inside the pore, outside the pore and pore entrance
+REGION_IN = 0
+REGION_EX = 1
+REGION_NONE = -1
+
+# Sample instance of a parallel worker process
+_WORKER_SAMPLE = None
+
+
+def _worker_init(sample):
+    """Store the sample instance once per parallel worker process.
+
+    Parameters
+    ----------
+    sample : Sample
+        Sample instance
+    """
+    global _WORKER_SAMPLE
+    _WORKER_SAMPLE = sample
+
+
+def _worker_run(frame_list, shift, is_pbc):
+    """Run the sampling helper of the worker sample instance.
+
+    Parameters
+    ----------
+    frame_list :
+        List of frame ids to process
+    shift : list
+        Distances for translating all positions in nano meter
+    is_pbc : bool
+        True to apply periodic boundary conditions
+
+    Returns : dictionary
+        Dictionary conatining all sampled data
+    """
+    return _WORKER_SAMPLE._sample_helper(frame_list, shift, is_pbc)
 
 
 class Sample:
@@ -61,6 +101,10 @@ class Sample:
         self._is_diffusion_bin = False
         self._is_diffusion_mc = False
 
+        # Data type of the saved floating point histograms - set to float for
+        # double precision output
+        self._dtype_save = np.float32
+
         # Get molecule ids
         self._atoms = [atom.get_name() for atom in mol.get_atom_list()] if not self._atoms else self._atoms
         self._atoms = [atom_id for atom_id in range(mol.get_num()) if mol.get_atom_list()[atom_id].get_name() in self._atoms]
@@ -72,29 +116,32 @@ class Sample:
             elif len(self._atoms) == 1:
                 self._masses = [1]
         self._sum_masses = sum(self._masses)
+        self._masses_arr = np.asarray(self._masses, dtype=float)
 
         # Check atom mass consistency
         if self._atoms and not len(self._masses) == len(self._atoms):
             print("Length of variables *atoms* and *masses* do not match!")
             return
 
-        # Get number of frames
-        traj = cf.Trajectory(self._traj)
-        self._num_frame = traj.nsteps
+        # Get number of frames and atoms - counting the frame atoms directly
+        # avoids copying the frame topology
+        with cf.Trajectory(self._traj) as traj:
+            self._num_frame = traj.nsteps
+            num_atoms = len(traj.read().atoms)
 
         # Get numer of residues
-        frame = traj.read()
-        num_res = len(frame.topology.atoms)/mol.get_num()
+        num_res = num_atoms/mol.get_num()
 
         # Check number of residues
         if abs(int(num_res)-num_res) >= 1e-5:
             print("Number of atoms is inconsistent with number of residues.")
             return
 
-        # Create residue list with all relevant atom ids
-        self._res_list = {}
-        for res_id in range(int(num_res)):
-            self._res_list[res_id] = [res_id*mol.get_num()+atom for atom in range(mol.get_num()) if atom in self._atoms]
+        # Create residue array with all relevant atom ids as rows - stored in
+        # the native index type so that the frame positions are gathered
+        # without converting the indices each frame
+        self._num_res = int(num_res)
+        self._res_list = np.arange(self._num_res, dtype=np.intp)[:, None]*mol.get_num()+np.asarray(self._atoms, dtype=np.intp)
 
         # Get pore properties
         self._pore_props = {}
@@ -114,11 +161,16 @@ class Sample:
             elif isinstance(self._pore, pms.PoreSlit):
                 self._pore_props["diam"] = self._pore.height()
 
+            # Cache pore dimensions used for each molecule
+            self._diam_half = self._pore_props["diam"]/2
+            self._box_z = self._pore_props["box"][2]
+            self._focal_z = self._pore_props["focal"][2]
+
 
     ########
     # Bins #
     ########
-    def _bin_in(self, bin_num):
+    def _bin_in(self, bin_num, dtype=float):
         """This function creates a simple bin structure for the interior of the
         pore based on the pore diameter.
 
@@ -126,19 +178,21 @@ class Sample:
         ----------
         bin_num : integer
             Number of bins to be used
+        dtype : type, optional
+            Data type of the bins
 
         Returns
         -------
         data : dictionary
-            Dictionary containing a list of the bin width and a data list
+            Dictionary containing an array of the bin width and a data array
         """
         # Define bins
-        width = [self._pore_props["diam"]/2/bin_num*x for x in range(bin_num+2)]
-        bins = [0 for x in range(bin_num+1)]
+        width = np.asarray([self._pore_props["diam"]/2/bin_num*x for x in range(bin_num+2)])
+        bins = np.zeros(bin_num+1, dtype=dtype)
 
         return {"width": width, "bins": bins}
 
-    def _bin_ex(self, bin_num):
+    def _bin_ex(self, bin_num, dtype=float):
         """This function creates a simple bin structure for the exterior of the
         pore based on the reservoir length.
 
@@ -146,22 +200,24 @@ class Sample:
         ----------
         bin_num : integer
             Number of bins to be used
+        dtype : type, optional
+            Data type of the bins
 
         Returns
         -------
         data : dictionary
-            Dictionary containing a list of the bin width and a data list
+            Dictionary containing an array of the bin width and a data array
         """
         # Process system
         z_length = self._pore_props["res"] if self._pore_props else self._box[2]
 
         # Define bins
-        width = [z_length/bin_num*x for x in range(bin_num+1)]
-        bins = [0 for x in range(bin_num+1)]
+        width = np.asarray([z_length/bin_num*x for x in range(bin_num+1)])
+        bins = np.zeros(bin_num+1, dtype=dtype)
 
         return {"width": width, "bins": bins}
 
-    def _bin_window(self, bin_num, len_window):
+    def _bin_window(self, bin_num, len_window, dtype=float):
         """This function creates window list for each bin for the interior of
         the pore based on the pore diameter.
 
@@ -171,15 +227,18 @@ class Sample:
             Number of bins to be used
         len_window : integer
             Window length
+        dtype : type, optional
+            Data type of the bins
 
         Returns
         -------
         data : dictionary
-            Dictionary containing a list of the bin width and a data list
+            Dictionary containing an array of the bin width and a data array
+            with bins as rows and windows as columns
         """
         # Define bins
-        width = [self._pore_props["diam"]/2/bin_num*x for x in range(bin_num+2)]
-        bins = [[0 for y in range(len_window)] for x in range(bin_num+1)]
+        width = np.asarray([self._pore_props["diam"]/2/bin_num*x for x in range(bin_num+2)])
+        bins = np.zeros((bin_num+1, len_window), dtype=dtype)
 
         return {"width": width, "bins": bins}
 
@@ -226,6 +285,10 @@ class Sample:
         self._is_density = True
         self._dens_inp = {"output": link_out, "bin_num": bin_num}
 
+        # Cache bin widths
+        self._dens_width_ex = self._bin_ex(bin_num)["width"][1]
+        self._dens_width_in = self._bin_in(bin_num)["width"][1] if self._pore else 0
+
     def _density_data(self):
         """Create density data structure.
 
@@ -238,17 +301,17 @@ class Sample:
         bin_num = self._dens_inp["bin_num"]
         data = {}
 
-        # Fill dictionary
+        # Fill dictionary - counts are stored as integers
         data["ex_width"] = self._bin_ex(bin_num)["width"]
-        data["ex"] = self._bin_ex(bin_num)["bins"]
+        data["ex"] = self._bin_ex(bin_num, int)["bins"]
 
         if self._pore:
             data["in_width"] = self._bin_in(bin_num)["width"]
-            data["in"] = self._bin_in(bin_num)["bins"]
+            data["in"] = self._bin_in(bin_num, int)["bins"]
 
         return data
 
-    def _density(self, data, region, dist, com):
+    def _density(self, data, region, dist, com, is_res):
         """This function samples the density inside and outside of the pore.
 
         All atoms are sampled each frame if they are inside or outside the
@@ -263,34 +326,33 @@ class Sample:
         ----------
         data : dictionary
             Data dictionary containing bins for the pore interior and exterior
-        region : string
-            Indicator wether molecule is inside or outside pore
-        dist : float
-            Distance of center of mass to pore surface area
-        com : list
-            Center of mass of current molecule
+        region : ndarray
+            Indicator wether molecules are inside or outside pore
+        dist : ndarray
+            Distance of center of mass to pore surface area of all molecules
+        com : ndarray
+            Center of mass of all molecules
+        is_res : ndarray
+            True for exterior molecules in the reservoir space in vicinity of
+            the crystobalit and not above the pore
         """
         bin_num = self._dens_inp["bin_num"]
 
-        # Add molecule to bin
-        if region=="in":
-            index = math.floor(dist/data["in_width"][1])
-            if index <= bin_num:
-                data["in"][index] += 1
-
-        elif region=="ex":
-            # Calculate distance to crystobalit and apply perodicity
-            lentgh = abs(com[2]-self._pore_props["box"][2]) if self._pore and com[2] >= self._pore_props["focal"][2] else com[2]
-            index = math.floor(lentgh/data["ex_width"][1])
+        # Add molecules inside pore to bins
+        if self._pore:
+            index = np.floor(dist[region==REGION_IN]/self._dens_width_in).astype(int)
+            data["in"] += np.bincount(index[index <= bin_num], minlength=bin_num+1)
 
-            # Only consider reservoir space in vicinity of crystobalit - remove pore
-            if self._pore:
-                is_add = dist > self._pore_props["diam"]/2 and index <= bin_num
-            else:
-                is_add = index <= bin_num
+        # Calculate distance to crystobalit and apply perodicity
+        lentgh = com[is_res, 2]
+        if self._pore:
+            lentgh = np.where(lentgh >= self._focal_z, np.abs(lentgh-self._box_z), lentgh)
+        index = np.floor(lentgh/self._dens_width_ex).astype(int)
 
-            if is_add:
-                data["ex"][index] += 1
+        # Add molecules outside pore to bins - negative indices count from
+        # the last bin as for list indexing
+        index = index[index <= bin_num]%(bin_num+1)
+        data["ex"] += np.bincount(index, minlength=bin_num+1)
 
 
     ############
@@ -310,6 +372,10 @@ class Sample:
         self._is_gyration = True
         self._gyr_inp = {"output": link_out, "bin_num": bin_num}
 
+        # Cache bin widths
+        self._gyr_width_ex = self._bin_ex(bin_num)["width"][1]
+        self._gyr_width_in = self._bin_in(bin_num)["width"][1] if self._pore else 0
+
     def _gyration_data(self):
         """Create gyration data structure.
 
@@ -332,7 +398,25 @@ class Sample:
 
         return data
 
-    def _gyration(self, data, region, dist, com, pos):
+    def _gyration_radius(self, com, pos):
+        """Calculate the gyration radius of all molecules.
+
+        Parameters
+        ----------
+        com : ndarray
+            Center of mass of all molecules
+        pos : ndarray
+            Atom positions of all molecules
+
+        Returns
+        -------
+        r_g : ndarray
+            Gyration radius of all molecules
+        """
+        vec = pos-com[:, None]
+        return np.sqrt(np.einsum("rai,rai,a->r", vec, vec, self._masses_arr)/self._sum_masses)
+
+    def _gyration(self, data, region, dist, com, r_g, is_res):
         """This function calculates the gyration radius of molecules inside the
         pore.
 
@@ -357,40 +441,38 @@ class Sample:
         ----------
         data : dictionary
             Data dictionary containing bins for the pore interior and exterior
-        region : string
-            Indicator wether molecule is inside or outside pore
-        dist : float
-            Distance of center of mass to pore surface area
-        com : list
-            Center of mass of current molecule
-        pos : list
-            List of atom positions of current molecule
+        region : ndarray
+            Indicator wether molecules are inside or outside pore
+        dist : ndarray
+            Distance of center of mass to pore surface area of all molecules
+        com : ndarray
+            Center of mass of all molecules
+        r_g : ndarray
+            Gyration radius of all molecules
+        is_res : ndarray
+            True for exterior molecules in the reservoir space in vicinity of
+            the crystobalit and not above the pore
         """
         # Initialize
         bin_num = self._gyr_inp["bin_num"]
 
-        # Calculate gyration radius
-        r_g = (sum([geometry.length(geometry.vector(pos[atom_id], com))**2*self._masses[atom_id] for atom_id in range(len(self._atoms))])/self._sum_masses)**0.5
-
-        # Add molecule to bin
-        if region=="in":
-            index = math.floor(dist/data["in_width"][1])
-            if index <= bin_num:
-                data["in"][index] += r_g
-
-        elif region=="ex":
-            # Calculate distance to crystobalit and apply perodicity
-            lentgh = abs(com[2]-self._pore_props["box"][2]) if self._pore and com[2] >= self._pore_props["focal"][2] else com[2]
-            index = math.floor(lentgh/data["ex_width"][1])
+        # Add molecules inside pore to bins
+        if self._pore:
+            is_in = region==REGION_IN
+            index = np.floor(dist[is_in]/self._gyr_width_in).astype(int)
+            is_add = index <= bin_num
+            data["in"] += np.bincount(index[is_add], r_g[is_in][is_add], minlength=bin_num+1)
 
-            # Only consider reservoir space in vicinity of crystobalit - remove pore
-            if self._pore:
-                is_add = dist > self._pore_props["diam"]/2 and index <= bin_num
-            else:
-                is_add = index <= bin_num
+        # Calculate distance to crystobalit and apply perodicity
+        lentgh = com[is_res, 2]
+        if self._pore:
+            lentgh = np.where(lentgh >= self._focal_z, np.abs(lentgh-self._box_z), lentgh)
+        index = np.floor(lentgh/self._gyr_width_ex).astype(int)
 
-            if is_add:
-                data["ex"][index] += r_g
+        # Add molecules outside pore to bins - negative indices count from
+        # the last bin as for list indexing
+        is_add = index <= bin_num
+        data["ex"] += np.bincount(index[is_add]%(bin_num+1), r_g[is_res][is_add], minlength=bin_num+1)
 
 
     #############
@@ -440,6 +522,9 @@ class Sample:
                               "bin_num": bin_num, "len_step": len_step,
                               "len_frame": len_frame, "len_window": len_window}
 
+        # Cache bin width
+        self._diff_bin_width = self._bin_window(bin_num, len_window)["width"][1] if self._pore else 0
+
     def _diffusion_bin_data(self):
         """Create bin diffusion data structure.
 
@@ -455,35 +540,66 @@ class Sample:
         # Create dictionary
         data = {}
         data["width"] = self._bin_window(bin_num, len_window)["width"]
-        bins = ["z", "r", "n", "z_tot", "r_tot", "n_tot"]
-        for bin in bins:
+        for bin in ["z", "r", "z_tot", "r_tot"]:
             data[bin] = self._bin_window(bin_num, len_window)["bins"]
+        for bin in ["n", "n_tot"]:
+            data[bin] = self._bin_window(bin_num, len_window, int)["bins"]
 
         return data
 
-    def _diffusion_bin_step(self, idx):
-        """Helper function to define allowed bin step list.
+    def _diffusion_bin_hist(self):
+        """Create the history ring buffer of the bin diffusion routine. For
+        each of the last :math:`w\\cdot s` frames the com and the radial bin
+        index are stored for all molecules. Molecules outside the pore have
+        bin index -1. Bin indices are capped above the largest index that can
+        be within the allowed bin step size of a sampled bin, which keeps them
+        in 16 bit integers.
+
+        Returns
+        -------
+        hist : dictionary
+            History ring buffer with the current frame slot and the number of
+            filled frames
+        """
+        # Initialize
+        len_fill = self._diff_bin_inp["len_window"]*self._diff_bin_inp["len_step"]
+        num_res = self._num_res
+        idx_max = self._diff_bin_inp["bin_num"]+self._diff_bin_inp["bin_step_size"]+1
+
+        # Create dictionary
+        hist = {}
+        hist["com"] = np.zeros((len_fill, num_res, 3))
+        hist["idx"] = np.full((len_fill, num_res), -1, dtype=np.int16 if idx_max < 2**15 else np.int32)
+        hist["idx_max"] = idx_max
+        hist["cur"] = -1
+        hist["num"] = 0
+
+        return hist
+
+    def _diffusion_bin_next(self, hist):
+        """Advance the history ring buffer to the next frame by clearing the
+        oldest frame slot.
 
         Parameters
         ----------
-        idx : integer
-            Bin index
+        hist : dictionary
+            History ring buffer
         """
-        out_list = [idx+x for x in range(self._diff_bin_inp["bin_step_size"], 0, -1)]
-        out_list += [idx]
-        out_list += [idx-x for x in range(1, self._diff_bin_inp["bin_step_size"]+1)]
-        return out_list
+        len_fill = hist["idx"].shape[0]
+        hist["cur"] = (hist["cur"]+1)%len_fill
+        hist["idx"][hist["cur"]] = -1
+        hist["num"] = min(hist["num"]+1, len_fill)
 
-    def _diffusion_bin(self, data, region, dist, com_list, idx_list, res_id, com):
+    def _diffusion_bin(self, data, region, dist, hist, com):
         """This function samples the mean square displacement of a molecule
         group in a pore in both axial and radial direction separated in radial
         bins.
 
-        First a centre of mass-list is filled with :math:`w\\cdot s` frames with
-        window length :math:`w` and stepsize :math:`s`. Each following frame
-        removes the first com of the list and a new added to the end of it. This
-        way only one loop over the frames is needed, since each frame is only
-        needed for :math:`w\\cdot s` frames in total.
+        First a centre of mass ring buffer is filled with :math:`w\\cdot s`
+        frames with window length :math:`w` and stepsize :math:`s`. Each
+        following frame overwrites the oldest com of the buffer. This way only
+        one loop over the frames is needed, since each frame is only needed for
+        :math:`w\\cdot s` frames in total.
 
         All molecule com's are sampled each window if they are inside the bounds
         of the pore minus an entry length on both sides. Once the com leaves the
@@ -522,85 +638,75 @@ class Sample:
         ----------
         data : dictionary
             Data dictionary containing bins for axial and radial diffusion
-        region : string
-            Indicator wether molecule is inside or outside pore
-        dist : float
-            Distance of center of mass to pore surface area
-        com_list : list
-            List of dictionaries containing coms of all molecules for each frame
-        index_list : list
-            List of dictionaries containing bin id of all molecules for each frame
-        res_id : integer
-            Current residue id
-        com : list
-            Center of mass of current molecule
+        region : ndarray
+            Indicator wether molecules are inside or outside pore
+        dist : ndarray
+            Distance of center of mass to pore surface area of all molecules
+        hist : dictionary
+            History ring buffer containing coms and bin ids of all molecules
+            for each frame
+        com : ndarray
+            Center of mass of all molecules
         """
         # Initialize
         bin_num = self._diff_bin_inp["bin_num"]
         len_step = self._diff_bin_inp["len_step"]
         len_window = self._diff_bin_inp["len_window"]
+        bin_step_size = self._diff_bin_inp["bin_step_size"]
 
         # Only sample diffusion inside the pore
-        if region == "in":
-            # Calculate bin index
-            index = math.floor(dist/data["width"][1])
-
-            # Add com and bin index to global lists
-            com_list[-1][res_id] = com
-            idx_list[-1][res_id] = index
-
-            # Start sampling when initial window is filled
-            if len(com_list) == len_window*len_step and res_id in com_list[0]:
-                # Set reference position
-                pos_ref = com_list[0][res_id]
-                idx_ref = idx_list[0][res_id]
-
-                # Create temporary msd lists
-                msd_z = [0 for x in range(len_window)]
-                msd_r = [0 for x in range(len_window)]
-                norm = [0 for x in range(len_window)]
-                len_msd = 0
-
-                # Run through position list to sample msd
-                for step in range(0, len_window*len_step, len_step):
-                    # Check if com is inside pore
-                    if res_id in com_list[step]:
-                        # Initialize step information
-                        pos_step = com_list[step][res_id]
-                        idx_step = idx_list[step][res_id]
-
-                        # Get window index
-                        win_idx = int(step/len_step)
-
-                        # Add to msd
-                        msd_z[win_idx] += (pos_ref[2]-pos_step[2])**2
-                        msd_r[win_idx] += geometry.length(geometry.vector(pos_ref, [pos_step[0], pos_step[1], pos_ref[2]]))**2
-
-                        # Add to normalize
-                        norm[win_idx] += 1
-
-                        # Check if com is within range of reference bin
-                        if idx_step in self._diffusion_bin_step(idx_ref):
-                            len_msd += 1
-
-                        # COM left radial bin
-                        else: break
-                    # COM left the boundary
-                    else: break
-
-                # Save msd
-                if idx_ref <= bin_num:
-                    for i in range(len_window):
-                        # Add to total list
-                        data["z_tot"][idx_ref][i] += msd_z[i]
-                        data["r_tot"][idx_ref][i] += msd_r[i]
-                        data["n_tot"][idx_ref][i] += norm[i]
-
-                        # Add to bin calculation list if msd is permissible
-                        if len_msd == len_window:
-                            data["z"][idx_ref][i] += msd_z[i]
-                            data["r"][idx_ref][i] += msd_r[i]
-                            data["n"][idx_ref][i] += norm[i]
+        is_in = region==REGION_IN
+
+        # Add coms and bin indices to history
+        index = np.floor(dist[is_in]/self._diff_bin_width).astype(int)
+        hist["com"][hist["cur"], is_in] = com[is_in]
+        hist["idx"][hist["cur"], is_in] = np.minimum(index, hist["idx_max"])
+
+        # Start sampling when initial window is filled
+        len_fill = len_window*len_step
+        if hist["num"] < len_fill:
+            return
+
+        # Get window frame slots starting from the oldest frame
+        slots = (hist["cur"]+1+np.arange(0, len_fill, len_step))%len_fill
+
+        # Get molecules inside the pore at the window start - windows as
+        # rows and molecules as columns
+        res_ids = np.flatnonzero(is_in & (hist["idx"][slots[0]] >= 0))
+        pos_steps = hist["com"][slots[:, None], res_ids]
+        idx_steps = hist["idx"][slots[:, None], res_ids].astype(int)
+
+        # Set reference position
+        pos_ref = pos_steps[0]
+        idx_ref = idx_steps[0]
+
+        # Check if com is inside pore and within range of reference bin
+        is_in = np.logical_and.accumulate(idx_steps >= 0, axis=0)
+        is_bin = np.abs(idx_steps-idx_ref) <= bin_step_size
+
+        # Sample until the com leaves the boundary or, including the step
+        # leaving it, the radial bin
+        is_msd = is_in.copy()
+        is_msd[1:] &= np.logical_and.accumulate(is_bin[:-1], axis=0)
+        is_full = is_in[-1] & is_bin.all(axis=0)
+
+        # Calculate msd from the squared deviations towards reference
+        dev = (pos_steps-pos_ref)**2
+        msd_z = (dev[:, :, 2]*is_msd).T
+        msd_r = ((dev[:, :, 0]+dev[:, :, 1])*is_msd).T
+        norm = is_msd.T.astype(int)
+
+        # Add to total list
+        is_tot = idx_ref <= bin_num
+        np.add.at(data["z_tot"], idx_ref[is_tot], msd_z[is_tot])
+        np.add.at(data["r_tot"], idx_ref[is_tot], msd_r[is_tot])
+        np.add.at(data["n_tot"], idx_ref[is_tot], norm[is_tot])
+
+        # Add to bin calculation list if msd is permissible
+        is_add = is_tot & is_full
+        np.add.at(data["z"], idx_ref[is_add], msd_z[is_add])
+        np.add.at(data["r"], idx_ref[is_add], msd_r[is_add])
+        np.add.at(data["n"], idx_ref[is_add], norm[is_add])
 
 
 
@@ -640,29 +746,52 @@ class Sample:
                               "bin_num": bin_num, "len_step": len_step,
                               "len_frame": len_frame, "pbc": pbc}
 
+        # Cache bin edges for the digitization and step lengths
+        self._diff_mc_bins = np.asarray(bins)
+        self._diff_mc_steps = np.asarray(len_step, dtype=int)
+
     def _diffusion_mc_data(self):
         """Create mc diffusion data structure.
 
         Returns
         -------
-        data : dictionary
-            Bin diffusion data structure
+        data : ndarray
+            Transition matrices of all step lengths stacked in order of the
+            step length list
         """
         # Initialize
         bin_num = self._diff_mc_inp["bin_num"]
         len_step= self._diff_mc_inp["len_step"]
 
-        # Create dictionary
-        data = {}
+        # Initialize transition matrices
+        data = np.zeros((len(len_step), bin_num+2, bin_num+2), int)
 
-        # Initialize transition matrix
-        for step in len_step:
-            data[step] = np.zeros((bin_num+2,bin_num+2),int)
+        return data
 
+    def _diffusion_mc_hist(self):
+        """Create the bin index ring buffer of the mc diffusion routine
+        containing the bin indices of all molecules for the last frames up to
+        the maximal step length.
 
-        return data
+        Returns
+        -------
+        hist : dictionary
+            History ring buffer with the current frame slot and the number of
+            filled frames
+        """
+        # Initialize
+        len_hist = max(self._diff_mc_inp["len_step"])+1
+        num_res = self._num_res
+
+        # Create dictionary
+        hist = {}
+        hist["idx"] = np.zeros((len_hist, num_res), dtype=np.int16 if self._diff_mc_inp["bin_num"]+2 < 2**15 else np.int32)
+        hist["cur"] = -1
+        hist["num"] = 0
 
-    def _diffusion_mc(self, data, idx_list_mc,res_id, com, frame_list, frame_id):
+        return hist
+
+    def _diffusion_mc(self, data, hist, com_z, frame_list, frame_id):
         """This function sample the transition matrix for the diffusion
         calculation with the Monte Carlo diffusion methode for a cubic
         simulation box. The sample of the transition matrix is to be run on
@@ -702,45 +831,39 @@ class Sample:
 
         Parameters
         ----------
-        data : dictionary
-            Data dictionary containing bins for axial and radial diffusion
-        index_list : list
-            List of dictionaries containing bin id of all molecules for each frame
-        res_id : integer
-            Current residue id
-        com : list
-            Center of mass of current molecule
-        frame_list : list
-            List of frame ids to process
+        data : ndarray
+            Transition matrices of all step lengths
+        hist : dictionary
+            History ring buffer containing bin ids of all molecules for each
+            frame
+        com_z : ndarray
+            Center of mass z-coordinate of all molecules in the current frame
+        frame_list : range
+            Frame ids to process
         frame_id : integer
             Current frame_id
         """
 
         # Initialize
-        bin_num = self._diff_mc_inp["bin_num"]
         len_step = self._diff_mc_inp["len_step"]
-        bins = self._bin_mc(bin_num)["bins"]
+        num_res = com_z.size
 
-        # Calculate bin index
-        idx_list_mc[-1][res_id] = np.digitize(com[2],bins)
+        # Overwrite oldest frame of the history with the bin indices
+        len_hist = hist["idx"].shape[0]
+        hist["cur"] = (hist["cur"]+1)%len_hist
+        hist["num"] = min(hist["num"]+1, len_hist)
+        hist["idx"][hist["cur"]] = np.digitize(com_z, self._diff_mc_bins)
 
-        # Sample the transition matrix for the len_step
-        if frame_list[0]==0:
-            for step in len_step:
-                if len(idx_list_mc) >= (step+1):
-                        # Calculate transition matrix in z direction
-                        start = idx_list_mc[-(step+1)][res_id]
-                        end = idx_list_mc[-1][res_id]
-                        data[step][end,start] += 1
+        # Sample the transition matrix for the len_step - for parallel
+        # calculation skip the window filling frames
+        if frame_list[0]==0 or frame_id>=(frame_list[0]+max(len_step)):
+            # Get step lengths with filled history
+            axis = np.flatnonzero(self._diff_mc_steps < hist["num"])
 
-        # For parallel calculation
-        if frame_list[0]!=0 and frame_id>=(frame_list[0]+max(self._diff_mc_inp["len_step"])):
-            for step in len_step:
-                if len(idx_list_mc) >= (step+1):
-                        # Calculate transition matrix in z direction
-                        start = idx_list_mc[-(step+1)][res_id]
-                        end = idx_list_mc[-1][res_id]
-                        data[step][end,start] += 1
+            # Calculate transition matrices in z direction of all step lengths
+            start = hist["idx"][(hist["cur"]-self._diff_mc_steps[axis])%len_hist].ravel()
+            end = np.tile(hist["idx"][hist["cur"]], axis.size)
+            np.add.at(data, (np.repeat(axis, num_res), end, start), 1)
 
 
 
@@ -792,12 +915,13 @@ class Sample:
                 frame_end = [x+max(self._diff_mc_inp["len_step"]) for i, x in enumerate(frame_end)]
                 frame_end[-1] = frame_end[-1]-max(self._diff_mc_inp["len_step"])
 
-            # Create working lists for processors
-            frame_np = [list(range(frame_start[i], frame_end[i])) for i in range(np)]
+            # Create frame ranges for processors - ranges are passed to the
+            # workers without pickling every frame id
+            frame_np = [range(frame_start[i], frame_end[i]) for i in range(np)]
 
-            # Run parallel search
-            pool = mp.Pool(processes=np)
-            results = [pool.apply_async(self._sample_helper, args=(frame_list, shift, is_pbc,)) for frame_list in frame_np]
+            # Run parallel search - the instance is passed once per process
+            pool = mp.Pool(processes=np, initializer=_worker_init, initargs=(self,))
+            results = [pool.apply_async(_worker_run, args=(frame_list, shift, is_pbc,)) for frame_list in frame_np]
             pool.close()
             pool.join()
             output = [x.get() for x in results]
@@ -806,9 +930,26 @@ class Sample:
             del results
         else:
             # Run sampling
-            output = [self._sample_helper(list(range(self._num_frame)), shift, is_pbc)]
+            output = [self._sample_helper(range(self._num_frame), shift, is_pbc)]
+
+        # Get data keys to be reduced of each routine
+        keys = {}
+        if self._is_density:
+            keys["density"] = ["in", "ex"] if self._pore else ["ex"]
+        if self._is_gyration:
+            keys["gyration"] = ["in", "ex"] if self._pore else ["ex"]
+        if self._is_diffusion_bin:
+            keys["diffusion_bin"] = ["z", "r", "n", "z_tot", "r_tot", "n_tot"]
+        if self._is_diffusion_mc:
+            keys["diffusion_mc"] = self._diff_mc_inp["len_step"]
+
+        # Concatenate output in a single pass over the processor outputs
+        for out in output[1:]:
+            for routine, data in out.items():
+                for key in keys[routine]:
+                    output[0][routine][key] += data[key]
 
-        # Concatenate output and create pickle object files
+        # Create pickle object files
         system = {"sys": "pore", "props": self._pore_props} if self._pore else {"sys": "box", "props": self._box}
         inp = {"num_frame": self._num_frame, "mass": self._mol.get_mass(), "entry": self._entry}
 
@@ -817,10 +958,6 @@ class Sample:
             inp_dens.update(self._dens_inp)
             inp_dens.pop("output")
             data_dens = output[0]["density"]
-            for out in output[1:]:
-                if self._pore:
-                    data_dens["in"] = [x+y for x, y in zip(data_dens["in"], out["density"]["in"])]
-                data_dens["ex"] = [x+y for x, y in zip(data_dens["ex"], out["density"]["ex"])]
             # Pickle
             utils.save({system["sys"]: system["props"], "inp": inp_dens, "data": data_dens}, self._dens_inp["output"])
 
@@ -829,10 +966,8 @@ class Sample:
             inp_gyr.update(self._gyr_inp)
             inp_gyr.pop("output")
             data_gyr = output[0]["gyration"]
-            for out in output[1:]:
-                if self._pore:
-                    data_gyr["in"] = [x+y for x, y in zip(data_gyr["in"], out["gyration"]["in"])]
-                data_gyr["ex"] = [x+y for x, y in zip(data_gyr["ex"], out["gyration"]["ex"])]
+            for bin in keys["gyration"]:
+                data_gyr[bin] = data_gyr[bin].astype(self._dtype_save, copy=False)
             # Pickle
             utils.save({system["sys"]: system["props"], "inp": inp_gyr, "data": data_gyr}, self._gyr_inp["output"])
 
@@ -841,15 +976,8 @@ class Sample:
             inp_diff.update(self._diff_bin_inp)
             inp_diff.pop("output")
             data_diff = output[0]["diffusion_bin"]
-            for out in output[1:]:
-                for i in range(self._diff_bin_inp["bin_num"]):
-                    for j in range(self._diff_bin_inp["len_window"]):
-                        data_diff["z"][i][j] += out["diffusion_bin"]["z"][i][j]
-                        data_diff["r"][i][j] += out["diffusion_bin"]["r"][i][j]
-                        data_diff["n"][i][j] += out["diffusion_bin"]["n"][i][j]
-                        data_diff["z_tot"][i][j] += out["diffusion_bin"]["z_tot"][i][j]
-                        data_diff["r_tot"][i][j] += out["diffusion_bin"]["r_tot"][i][j]
-                        data_diff["n_tot"][i][j] += out["diffusion_bin"]["n_tot"][i][j]
+            for bin in ["z", "r", "z_tot", "r_tot"]:
+                data_diff[bin] = data_diff[bin].astype(self._dtype_save, copy=False)
             # Pickle
             utils.save({system["sys"]: system["props"], "inp": inp_diff, "data": data_diff}, self._diff_bin_inp["output"])
 
@@ -859,24 +987,171 @@ class Sample:
             inp_diff.update(self._diff_mc_inp)
             inp_diff.pop("output")
             data_diff = output[0]["diffusion_mc"]
-            for step in self._diff_mc_inp["len_step"]:
-                data_diff[step] = data_diff[step]
-                for out in output[1:]:
-                    data_diff[step] += out["diffusion_mc"][step]
-
-            for step in self._diff_mc_inp["len_step"]:
-                data_diff[step] = data_diff[step][1:-1,1:-1]
-
             # Pickle
             utils.save({"inp": inp_diff, "data": data_diff}, self._diff_mc_inp["output"])
 
+    def _dist_cylinder(self, com):
+        """Calculate the distance of molecules towards the cylinder pore
+        center axis.
+
+        Parameters
+        ----------
+        com : ndarray
+            Center of mass of all molecules
+
+        Returns
+        -------
+        dist : ndarray
+            Distance towards the center axis of all molecules
+        """
+        dx = com[:, 0]-self._pore_props["focal"][0]
+        dy = com[:, 1]-self._pore_props["focal"][1]
+        return np.sqrt(dx*dx+dy*dy)
+
+    def _dist_slit(self, com):
+        """Calculate the distance of molecules towards the slit pore center
+        plane.
+
+        Parameters
+        ----------
+        com : ndarray
+            Center of mass of all molecules
+
+        Returns
+        -------
+        dist : ndarray
+            Distance towards the center plane of all molecules
+        """
+        return np.abs(self._pore_props["focal"][1]-com[:, 1])
+
+    def _dist_box(self, com):
+        """Distance of molecules in a simple box system, which is always zero.
+
+        Parameters
+        ----------
+        com : ndarray
+            Center of mass of all molecules
+
+        Returns
+        -------
+        dist : ndarray
+            Zero distance of all molecules
+        """
+        return np.zeros(com.shape[0])
+
+    def _sample_frame(self, output, region, dist, com, com_no_pbc, r_g):
+        """Run the density and gyration sampling routines for all molecules
+        of a frame. The pore exclusion of exterior molecules is determined
+        once and shared by the routines.
+
+        Parameters
+        ----------
+        output : dictionary
+            Data dictionaries of all enabled routines
+        region : ndarray
+            Indicator wether molecules are inside or outside pore
+        dist : ndarray
+            Distance of center of mass to pore surface area of all molecules
+        com : ndarray
+            Center of mass of all molecules
+        com_no_pbc : ndarray
+            Center of mass of all molecules without periodic boundary
+            conditions
+        r_g : ndarray
+            Gyration radius of all molecules
+        """
+        # Only consider reservoir space in vicinity of crystobalit - remove pore
+        is_res = region==REGION_EX
+        if self._pore:
+            is_res &= dist > self._diam_half
+
+        # Sampling routines
+        if self._is_density:
+            self._density(output["density"], region, dist, com, is_res)
+        if self._is_gyration:
+            self._gyration(output["gyration"], region, dist, com_no_pbc, r_g, is_res)
+
+    def _read_frames(self, traj, frame_list, len_block=16, len_queue=4):
+        """Generator reading the frames of the trajectory in a background
+        thread. This way the decompression of the next frames overlaps with
+        the sampling of the current frame. Frames are read in blocks, which
+        are stored in one position array and passed to the main thread at
+        once.
+
+        Parameters
+        ----------
+        traj : Trajectory
+            Chemfiles trajectory
+        frame_list : range
+            Frame ids to read
+        len_block : integer, optional
+            Number of frames per block
+        len_queue : integer, optional
+            Maximal number of blocks read ahead
+
+        Yields
+        ------
+        frame : tuple
+            Frame id and array of atom positions
+        """
+        frames = queue.Queue(maxsize=len_queue)
+        stop = threading.Event()
+
+        # Put an item into the queue unless reading was stopped
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        # Read frame blocks into the queue, errors are passed to the main
+        # thread
+        def read():
+            try:
+                for start in range(0, len(frame_list), len_block):
+                    block_ids = frame_list[start:start+len_block]
+                    block = None
+                    for i, frame_id in enumerate(block_ids):
+                        if stop.is_set():
+                            return
+                        # Copy positions while the frame owning them is alive
+                        frame = traj.read_step(frame_id)
+                        if block is None:
+                            block = np.empty((len(block_ids), len(frame.atoms), 3))
+                        block[i] = frame.positions
+                    if not put((block_ids, block)):
+                        return
+            except Exception as error:
+                put(error)
+            put(None)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+
+        # Yield frames as soon as their block is available - the reader is
+        # stopped if sampling fails or the generator is closed early
+        try:
+            while True:
+                block = frames.get()
+                if block is None:
+                    break
+                elif isinstance(block, Exception):
+                    raise block
+                yield from zip(*block)
+        finally:
+            stop.set()
+            reader.join()
+
     def _sample_helper(self, frame_list, shift, is_pbc):
         """Helper function for sampling run.
 
         Parameters
         ----------
-        frame_list :
-            List of frame ids to process
+        frame_list : range
+            Frame ids to process
         shift : list
             Distances for translating all positions in nano meter
         is_pbc : bool, optional
@@ -888,106 +1163,120 @@ class Sample:
         # Initialize
         box = self._pore_props["box"] if self._pore else self._box
         res = self._pore_props["res"] if self._pore else 0
-        com_list = []
-        idx_list = []
-        idx_list_mc = []
+        box_arr = np.asarray(box, dtype=float)
+
+        # Set distance function of the pore type
+        if isinstance(self._pore, pms.PoreCylinder):
+            dist_fn = self._dist_cylinder
+        elif isinstance(self._pore, pms.PoreSlit):
+            dist_fn = self._dist_slit
+        else:
+            dist_fn = self._dist_box
 
         # Load trajectory
         traj = cf.Trajectory(self._traj)
         frame_form = "%"+str(len(str(self._num_frame)))+"i"
 
+        # Limit progress output to about 200 updates per run
+        len_print = max(10, self._num_frame//200)
+
         # Create local data structures
         output = {}
+        hist_bin = None
         if self._is_density:
             output["density"] = self._density_data()
         if self._is_gyration:
             output["gyration"] = self._gyration_data()
         if self._is_diffusion_bin:
             output["diffusion_bin"] = self._diffusion_bin_data()
+            hist_bin = self._diffusion_bin_hist()
+            len_fill = self._diff_bin_inp["len_window"]*self._diff_bin_inp["len_step"]
         if self._is_diffusion_mc:
             output["diffusion_mc"] = self._diffusion_mc_data()
+            hist_mc = self._diffusion_mc_hist()
+
+        # Create frame data structures
+        num_res = self._num_res
+        is_region = self._is_density or self._is_gyration or self._is_diffusion_bin
+        res_ids = np.arange(num_res)
+        dist_prev = 0
+        r_g_all = None
+
+        # Run through frames - the reader and trajectory are closed on errors
+        frames = self._read_frames(traj, frame_list)
+        try:
+            for frame_id, positions in frames:
+                # Overwrite oldest frame of the history
+                if self._is_diffusion_bin:
+                    self._diffusion_bin_next(hist_bin)
 
-        # Run through frames
-        for frame_id in frame_list:
-            # Read frame
-            frame = traj.read_step(frame_id)
-            positions = frame.positions
+                # Remove window filling instances except from first processor
+                if self._is_diffusion_bin:
+                    is_sample = hist_bin["num"]==len_fill or frame_id<=len_fill
+                else:
+                    is_sample = True
 
-            # Add new dictionaries and remove unneeded references
-            if self._is_diffusion_bin:
-                len_fill = self._diff_bin_inp["len_window"]*self._diff_bin_inp["len_step"]
-                if len(com_list) >= len_fill:
-                    com_list.pop(0)
-                    idx_list.pop(0)
-                com_list.append({})
-                idx_list.append({})
-
-            # Add new dictionaries and remove unneeded references
-            if self._is_diffusion_mc:
-                if len(idx_list_mc) >= (max(self._diff_mc_inp["len_step"])+1):
-                    idx_list_mc.pop(0)
-                idx_list_mc.append({})
-
-            # Run through residues
-            for res_id in self._res_list:
-                # Get position vectors
-                pos = [[positions[self._res_list[res_id][atom_id]][i]/10+shift[i] for i in range(3)] for atom_id in range(len(self._atoms))]
-
-                # Calculate centre of mass
-                com_no_pbc = [sum([pos[atom_id][i]*self._masses[atom_id] for atom_id in range(len(self._atoms))])/self._sum_masses for i in range(3)]
-
-                # Remove broken molecules
-                if self._is_diffusion_bin or self._is_density:
-                    is_broken = False
-                    for i in range(3):
-                        is_broken = abs(com_no_pbc[i]-pos[0][i])>box[i]/3
-                        if is_broken:
-                            break
+                # Get position vectors and centres of mass of all residues
+                pos_all = positions[self._res_list]/10+shift
+                com_no_pbc_all = np.einsum("rai,a->ri", pos_all, self._masses_arr)/self._sum_masses
 
                 # Apply periodic boundary conditions
                 if is_pbc:
-                    com = [com_no_pbc[i]-math.floor(com_no_pbc[i]/box[i])*box[i] for i in range(3)]
-                else:
-                    com = com_no_pbc
-
-                # Sample if molecule not broken near boundary
-                if self._is_diffusion_bin or self._is_density:
-                    if not is_broken:
-                        # Calculate distance towards center axis
-                        if isinstance(self._pore, pms.PoreCylinder):
-                            dist = geometry.length(geometry.vector([self._pore_props["focal"][0], self._pore_props["focal"][1], com[2]], com))
-                        elif isinstance(self._pore, pms.PoreSlit):
-                            dist = abs(self._pore_props["focal"][1]-com[1])
-                        else:
-                            dist = 0
-
-                # Set region - in-inside, ex-outside
-                region = ""
-                if self._pore and com[2] > res+self._entry and com[2] < box[2]-res-self._entry:
-                    region = "in"
-                elif not self._pore or com[2] <= res or com[2] > box[2]-res:
-                    region = "ex"
-
-                # Remove window filling instances except from first processor
-                if self._is_diffusion_bin:
-                    is_sample = len(com_list)==len_fill or frame_id<=len_fill
+                    com_all = com_no_pbc_all-np.floor(com_no_pbc_all/box_arr)*box_arr
                 else:
-                    is_sample = True
+                    com_all = com_no_pbc_all
+
+                # Molecule regions are only needed for the bin routines
+                if is_region:
+                    # Remove broken molecules
+                    if self._is_diffusion_bin or self._is_density:
+                        is_broken_all = (np.abs(com_no_pbc_all-pos_all[:, 0])>box_arr/3).any(axis=1)
+
+                    # Calculate distance towards center axis
+                    dist_all = dist_fn(com_all)
+
+                    # Broken molecules keep the distance of the previous unbroken
+                    # molecule
+                    if self._is_diffusion_bin or self._is_density:
+                        idx_prev = np.maximum.accumulate(np.where(is_broken_all, -1, res_ids))
+                        dist_all = np.where(idx_prev >= 0, dist_all[idx_prev], dist_prev)
+                        dist_prev = dist_all[-1]
+
+                    # Set region - in-inside, ex-outside
+                    if self._pore:
+                        com_z = com_all[:, 2]
+                        region_all = np.full(num_res, REGION_NONE)
+                        region_all[(com_z <= res) | (com_z > box[2]-res)] = REGION_EX
+                        region_all[(com_z > res+self._entry) & (com_z < box[2]-res-self._entry)] = REGION_IN
+                    else:
+                        region_all = np.full(num_res, REGION_EX)
+
+                # Calculate gyration radius
+                if self._is_gyration:
+                    r_g_all = self._gyration_radius(com_no_pbc_all, pos_all)
 
                 # Sampling routines
-                if is_sample:
-                    if self._is_density:
-                        self._density(output["density"], region, dist, com)
-                    if self._is_gyration:
-                        self._gyration(output["gyration"], region, dist, com_no_pbc, pos)
                 if self._is_diffusion_bin:
-                    self._diffusion_bin(output["diffusion_bin"], region, dist, com_list, idx_list, res_id, com)
+                    self._diffusion_bin(output["diffusion_bin"], region_all, dist_all, hist_bin, com_all)
+
+                # Sample all molecules of the frame
+                if is_sample and (self._is_density or self._is_gyration):
+                    self._sample_frame(output, region_all, dist_all, com_all, com_no_pbc_all, r_g_all)
                 if self._is_diffusion_mc:
-                    self._diffusion_mc(output["diffusion_mc"], idx_list_mc, res_id, com, frame_list, frame_id)
+                    self._diffusion_mc(output["diffusion_mc"], hist_mc, com_all[:, 2], frame_list, frame_id)
+
+                # Progress
+                if (frame_id+1)%len_print==0 or frame_id==0 or frame_id==self._num_frame-1:
+                    sys.stdout.write("Finished frame "+frame_form%(frame_id+1)+"/"+frame_form%self._num_frame+"...\r")
+                    sys.stdout.flush()
+            print()
+        finally:
+            frames.close()
+            traj.close()
+
+        # Split transition matrices by step length and remove the outer bins
+        # of values beyond the bin edges - only the views are returned
+        if self._is_diffusion_mc:
+            output["diffusion_mc"] = {step: output["diffusion_mc"][i, 1:-1, 1:-1] for i, step in enumerate(self._diff_mc_inp["len_step"])}
 
-            # Progress
-            if (frame_id+1)%10==0 or frame_id==0 or frame_id==self._num_frame-1:
-                sys.stdout.write("Finished frame "+frame_form%(frame_id+1)+"/"+frame_form%self._num_frame+"...\r")
-                sys.stdout.flush()
-        print()
         return output
@@ -6,6 +6,7 @@
 
 
 import os
+import gzip
 import time
 import pickle
 
@@ -87,8 +88,15 @@ def toc(t, message="", is_print=True):
     return t_diff
 
 
-def save(obj, link):
-    """Save an object using pickle in the specified link.
+def save(obj, link, is_compress=False):
+    """Save an object using pickle in the specified link. Pickle protocol 4
+    is used, which is the highest protocol readable by all supported Python
+    versions, so that object files sampled on a cluster can be analysed
+    elsewhere.
+
+    Optionally the pickle stream is gzip compressed, which considerably
+    reduces the file size of sparse histograms. Compressed files are detected
+    automatically by :func:`load`.
 
     Parameters
     ----------
@@ -96,9 +104,11 @@ def save(obj, link):
         Object to be saved
     link : string
         Specific link to save object
+    is_compress : bool, optional
+        True to compress the pickle stream
     """
-    with open(link, "wb") as f:
-        pickle.dump(obj, f)
+    with (gzip.open(link, "wb", compresslevel=3) if is_compress else open(link, "wb")) as f:
+        pickle.dump(obj, f, protocol=4)
 
 
 def load(link):
@@ -114,7 +124,11 @@ def load(link):
     obj : Object
         Loaded object
     """
+    # Check for gzip compression
     with open(link, 'rb') as f:
+        is_compress = f.read(2) == b"\x1f\x8b"
+
+    with (gzip.open(link, 'rb') if is_compress else open(link, 'rb')) as f:
         return pickle.load(f)
 
 
@@ -191,15 +191,15 @@ class UserModelCase(unittest.TestCase):
 
         # Set the variable because this happen in the do_mc_cycles function -> not necessary to call to check the likelihood and Check if the initalize likelihood is correct
         MC._len_step = 1
-        self.assertEqual(MC.log_likelihood_z(model),  -128852.33005868513)
+        self.assertAlmostEqual(MC.log_likelihood_z(model), -128852.33005868513, places=5)
 
         # Set the variable because this happen in the do_mc_cycles function -> not necessary to call to check the likelihood and Check if the initalize likelihood is correct
         MC._len_step = 2
-        self.assertEqual(MC.log_likelihood_z(model),  -165354.76731180004)
+        self.assertAlmostEqual(MC.log_likelihood_z(model), -165354.76731180004, places=5)
 
         # Set the variable because this happen in the do_mc_cycles function -> not necessary to call to check the likelihood and Check if the initalize likelihood is correct
         MC._len_step = 10
-        self.assertEqual(MC.log_likelihood_z(model),  -258946.70553844847)
+        self.assertAlmostEqual(MC.log_likelihood_z(model), -258946.70553844847, places=5)
 
 
     # Check initial profiles
@@ -5,6 +5,7 @@ import copy
 import shutil
 import unittest
 
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
@@ -60,6 +61,15 @@ class UserModelCase(unittest.TestCase):
         sample.init_diffusion_bin("output/diff_cyl_p.obj")
         sample.sample(is_parallel=True, is_pbc=False)
 
+        ## MC diffusion
+        sample = pa.Sample("data/pore_system_cylinder.obj", "data/traj_cylinder.xtc", mol_B)
+        sample.init_diffusion_mc("output/diff_mc_cyl_s.obj", len_step=[1, 2, 5])
+        sample.sample(is_parallel=False)
+
+        sample = pa.Sample("data/pore_system_cylinder.obj", "data/traj_cylinder.xtc", mol_B)
+        sample.init_diffusion_mc("output/diff_mc_cyl_p.obj", len_step=[1, 2, 5])
+        sample.sample(is_parallel=True)
+
 
     #########
     # Utils #
@@ -73,6 +83,8 @@ class UserModelCase(unittest.TestCase):
 
         pa.utils.save([1, 1, 1], file_link)
         self.assertEqual(pa.utils.load(file_link), [1, 1, 1])
+        pa.utils.save([1, 1, 1], file_link, is_compress=True)
+        self.assertEqual(pa.utils.load(file_link), [1, 1, 1])
 
         self.assertEqual(round(pa.utils.mumol_m2_to_mols(3, 100), 4), 180.66)
         self.assertEqual(round(pa.utils.mols_to_mumol_m2(180, 100), 4), 2.989)
@@ -210,14 +222,42 @@ class UserModelCase(unittest.TestCase):
         plt.savefig("output/diffusion_cui.pdf", format="pdf", dpi=1000)
         # plt.show()
 
+        diff_cui = pa.diffusion.cui("output/diff_cyl_s.obj", intent="axial", is_plot=False)
+        self.assertEqual(round(diff_cui["axial"], 2), 0.74)
+
         # Mean diffusion based on bins
         plt.figure()
         mean_s = pa.diffusion.mean("output/diff_cyl_s.obj", "output/dens_cyl_s.obj", is_check=True)
         plt.savefig("output/diff_mean_check.pdf", format="pdf", dpi=1000)
         mean_p = pa.diffusion.mean("output/diff_cyl_p.obj", "output/dens_cyl_p.obj")
 
-        self.assertEqual(round(mean_s, 2), 1.13)
-        self.assertEqual(round(mean_p, 2), 1.13)
+        self.assertEqual(round(mean_s, 2), 1.12)
+        self.assertEqual(round(mean_p, 2), 1.12)
+
+
+    def test_diffusion_numexpr(self):
+        if pa.diffusion.ne is None:
+            self.skipTest("Numexpr not installed")
+
+        # Compare numexpr and NumPy summands of the radial msd
+        x = np.linspace(0, 1e-10, 50)
+        sm_ne = pa.diffusion._diff_rad_sum(x, 3e9, ne_size=0)
+        sm_np = pa.diffusion._diff_rad_sum(x, 3e9, ne_size=np.inf)
+        self.assertTrue(np.allclose(sm_ne, sm_np))
+
+
+    ################
+    # MC Diffusion #
+    ################
+    def test_diffusion_mc_sample(self):
+        data_s = pa.utils.load("output/diff_mc_cyl_s.obj")["data"]
+        data_p = pa.utils.load("output/diff_mc_cyl_p.obj")["data"]
+
+        # Each molecule adds one transition per frame after the step length
+        for step, trace in zip([1, 2, 5], [75701, 63409, 46045]):
+            self.assertEqual(data_s[step].sum(), 60*(2001-step))
+            self.assertEqual(np.trace(data_s[step]), trace)
+            self.assertTrue(np.array_equal(data_s[step], data_p[step]))
 
 
     ############
@@ -257,5 +297,22 @@ class UserModelCase(unittest.TestCase):
         pa.gyration.plot("output/gyr_cyl_s.obj", "output/dens_cyl_s.obj", intent="DOTA")
 
 
+    #########
+    # Model #
+    #########
+    def test_step_profile(self):
+        # Step model with the bases created in the initialization
+        model = pa.StepModel("output/diff_mc_cyl_s.obj", n_diff=5, n_df=8, n_diff_radial=4)
+        bin_num = model._bin_num
+
+        # Compare step profiles with the bin center and border bases
+        for basis, x0, offset in [(model._df_basis, model._df_x0, 0.5),
+                                  (model._diff_radial_basis, model._diff_radial_x0, 0.5),
+                                  (model._diff_basis, model._diff_x0, 1.)]:
+            coeff = np.linspace(-1, 2, x0.size)
+            profile = model.calc_step_profile(coeff, x0, offset, bin_num)
+            self.assertTrue(np.allclose(profile, np.dot(basis, coeff)))
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)